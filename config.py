@@ -1,14 +1,17 @@
 import os
 import logging
+import httpx
 from dotenv import load_dotenv
-from supabase import create_client, AsyncClient
+from supabase import AsyncClient, AsyncClientOptions
 
 # Load environment variables from .env file
 load_dotenv()
 
-# Set up logging
+# Set up logging. Per-message and per-query detail is logged at DEBUG;
+# set LOG_LEVEL=WARNING in production to keep only problems.
 logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    level=os.environ.get("LOG_LEVEL", "INFO").upper(),
 )
 logger = logging.getLogger(__name__)
 
@@ -29,9 +32,22 @@ if not ENCRYPTION_KEY or len(ENCRYPTION_KEY) != 64:
     logger.error("ENCRYPTION_KEY environment variable is not set or is not a 64-character hex string.")
     raise ValueError("ENCRYPTION_KEY environment variable is not set or is not a 64-character hex string.")
 
-# Initialize Supabase client
+# Shared HTTP client so every Supabase query reuses the same keep-alive
+# TCP+TLS connections instead of reconnecting per request
+http_client = httpx.AsyncClient(
+    http2=True,
+    limits=httpx.Limits(max_keepalive_connections=50, max_connections=100, keepalive_expiry=60),
+    timeout=httpx.Timeout(10.0, connect=3.0),
+)
+
+# Initialize the async Supabase client so queries are awaited instead of
+# blocking the event loop. The constructor is used directly (rather than
+# acreate_client) because this runs at import time; the service key needs
+# no session restore.
 try:
-    supabase: AsyncClient = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
+    supabase: AsyncClient = AsyncClient(
+        SUPABASE_URL, SUPABASE_SERVICE_KEY, options=AsyncClientOptions(httpx_client=http_client)
+    )
 except Exception as e:
-    logger.error(f"Failed to initialize Supabase client: {e}")
+    logger.error("Failed to initialize Supabase client: %s", e)
     raise
\ No newline at end of file
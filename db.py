@@ -1,31 +1,113 @@
 import logging
-from datetime import datetime
+from datetime import datetime, timedelta
+
+from cachetools import TTLCache
 
 from config import supabase
-from utils import decrypt, encrypt
+from utils import KeyedLocks, decrypt_many, encrypt, encrypt_many, parse_timezone_offset
 
 logger = logging.getLogger(__name__)
 
+# UserSettings rows change rarely but are read on almost every update, so keep
+# them in-process for a few minutes. Per-chat locks make a burst of messages
+# from the same chat share a single Supabase lookup.
+_settings_cache = TTLCache(maxsize=10_000, ttl=300)
+_settings_locks = KeyedLocks()
+
+# Full telegram_id -> settings snapshot, rebuilt periodically by
+# refresh_user_settings_cache so most lookups never touch the network.
+# Each refresh swaps in a new dict; between refreshes,
+# invalidate_user_settings drops single stale entries from it.
+_settings_snapshot: dict[str, dict] = {}
+
+# Maximum number of user ids sent in a single IN-list query.
+REMINDER_BATCH_SIZE = 500
+
+# Columns kept for each cached UserSettings entry.
+_SETTINGS_FIELDS = ("user_id", "timezone_offset", "timetable_start", "timetable_end")
+
+# PostgREST caps responses at 1000 rows by default, so page through it.
+SETTINGS_PAGE_SIZE = 1000
+
+
+def _decrypt_titles(tasks: list[dict]):
+    with_title = [task for task in tasks if "title" in task]
+    titles = decrypt_many([task["title"] for task in with_title])
+    for task, title in zip(with_title, titles):
+        task["title"] = title
+
 
 async def get_user_settings_by_telegram_chat_id(chat_id: str):
-    logger.info(f"Looking up user settings for chat_id: {chat_id}")
+    cached = _settings_cache.get(chat_id) or _settings_snapshot.get(chat_id)
+    if cached is not None:
+        return cached
+
+    async with _settings_locks.hold(chat_id):
+        cached = _settings_cache.get(chat_id)
+        if cached is not None:
+            return cached
+
+        settings = await _fetch_user_settings(chat_id)
+        if settings:
+            _settings_cache[chat_id] = settings
+
+    return settings
+
+
+def invalidate_user_settings(chat_id: str):
+    _settings_cache.pop(chat_id, None)
+    _settings_snapshot.pop(chat_id, None)
+
+
+async def refresh_user_settings_cache():
+    """Reload every linked UserSettings row into the in-process snapshot."""
+    global _settings_snapshot
     try:
-        response = (
+        snapshot = {}
+        start = 0
+        while True:
+            response = await (
+                supabase.table("UserSettings")
+                .select("telegram_id, user_id, timezone_offset, timetable_start, timetable_end")
+                .not_.is_("telegram_id", "null")
+                .order("telegram_id")
+                .range(start, start + SETTINGS_PAGE_SIZE - 1)
+                .execute()
+            )
+            rows = response.data or []
+            for row in rows:
+                snapshot[str(row.pop("telegram_id"))] = row
+
+            if len(rows) < SETTINGS_PAGE_SIZE:
+                break
+            start += SETTINGS_PAGE_SIZE
+
+        _settings_snapshot = snapshot
+        logger.info("Refreshed settings snapshot with %s users", len(snapshot))
+    except Exception as e:
+        logger.error("Error refreshing user settings snapshot: %s", e)
+
+
+async def _fetch_user_settings(chat_id: str):
+    logger.debug("Looking up user settings for chat_id: %s", chat_id)
+    try:
+        response = await (
             supabase.table("UserSettings")
             .select("user_id, timezone_offset, timetable_start, timetable_end")
             .eq("telegram_id", chat_id)
-            .limit(1)
-            .single()
+            .maybe_single()
             .execute()
         )
-        if response.data:
-            logger.info(f"Found settings for chat_id: {chat_id}")
+        # maybe_single() yields no response at all (rather than raising) when
+        # the chat is not linked
+        if response and response.data:
+            logger.debug("Found settings for chat_id: %s", chat_id)
             return response.data
         else:
-            logger.warning(f"No user settings found for chat_id: {chat_id}")
+            logger.warning("No user settings found for chat_id: %s", chat_id)
             return None
     except Exception as e:
-        logger.error(f"Error fetching user settings for chat_id {chat_id}: {e}")
+        logger.error("Error fetching user settings for chat_id %s: %s", chat_id, e)
         return None
 
 
@@ -33,12 +115,12 @@ async def fetch_schedule_for_user_in_range(
     user_id: str, range_start: datetime, range_end: datetime
 ):
     try:
-        logger.info(
-            f"Fetching tasks for user {user_id} between {range_start.isoformat()} and {range_end.isoformat()}"
+        logger.debug(
+            "Fetching tasks for user %s between %s and %s", user_id, range_start, range_end
         )
-        response = (
+        response = await (
             supabase.table("tasks")
-            .select("*")
+            .select("id, scheduled_time, is_completed, title, duration_minutes")
             .eq("user_id", user_id)
             .gte("scheduled_time", range_start.isoformat())
             .lt("scheduled_time", range_end.isoformat())
@@ -47,28 +129,69 @@ async def fetch_schedule_for_user_in_range(
         )
 
         if response.data:
-            for task in response.data:
-                if "title" in task:
-                    task["title"] = decrypt(task["title"])
+            _decrypt_titles(response.data)
 
         return response.data
     except Exception as e:
-        logger.error(f"Error fetching tasks for user {user_id}: {e}")
+        logger.error("Error fetching tasks for user %s: %s", user_id, e)
         return []
 
 
+async def get_today_schedule(chat_id: str):
+    """Fetch a chat's settings and today's tasks in a single round-trip.
+
+    Uses the get_today_schedule RPC and falls back to the separate settings
+    and tasks queries if it fails. Returns a (settings, tasks) tuple where
+    settings is None when the chat is not linked to an account.
+    """
+    try:
+        response = await supabase.rpc("get_today_schedule", {"p_chat_id": chat_id}).execute()
+        data = response.data or {}
+        settings = data.get("settings")
+        tasks = data.get("tasks") or []
+
+        if settings:
+            _settings_cache[chat_id] = settings
+        _decrypt_titles(tasks)
+
+        return settings, tasks
+    except Exception as e:
+        logger.error("get_today_schedule RPC failed for chat_id %s, falling back: %s", chat_id, e)
+
+    settings = await get_user_settings_by_telegram_chat_id(chat_id)
+    user_timezone = parse_timezone_offset(settings.get("timezone_offset")) if settings else None
+    if not user_timezone:
+        return settings, []
+
+    # Naive local-day bounds, matching the RPC: scheduled_time holds naive
+    # local wall-clock times, and aware bounds would be shifted by the offset
+    range_start = datetime.now(user_timezone).replace(
+        hour=0, minute=0, second=0, microsecond=0, tzinfo=None
+    )
+    range_end = range_start + timedelta(days=1)
+    tasks = await fetch_schedule_for_user_in_range(settings["user_id"], range_start, range_end)
+
+    return settings, tasks
+
+
 async def update_user_timezone(chat_id: str, offset_str: str):
     try:
-        response = (
+        response = await (
             supabase.table("UserSettings")
             .update({"timezone_offset": offset_str})
             .eq("telegram_id", chat_id)
             .execute()
         )
-        logger.info(f"Updated timezone for chat_id {chat_id}: {response.data}")
+        logger.info("Updated timezone for chat_id %s: %s", chat_id, response.data)
+        if response.data:
+            # Write the updated row through so the next command skips the
+            # lookup instead of re-fetching what we just wrote
+            row = response.data[0]
+            invalidate_user_settings(chat_id)
+            _settings_cache[chat_id] = {key: row.get(key) for key in _SETTINGS_FIELDS}
         return response.data
     except Exception as e:
-        logger.error(f"Error updating timezone for chat_id {chat_id}: {e}")
+        logger.error("Error updating timezone for chat_id %s: %s", chat_id, e)
         return None
 
 
@@ -77,22 +200,40 @@ async def create_task(new_task: dict):
         if "title" in new_task:
             new_task["title"] = encrypt(new_task["title"])
 
-        response = supabase.table("tasks").insert(new_task).execute()
+        response = await supabase.table("tasks").insert(new_task).execute()
 
         if response.data:
-            for task in response.data:
-                if "title" in task:
-                    task["title"] = decrypt(task["title"])
+            _decrypt_titles(response.data)
 
         return response.data
     except Exception as e:
-        logger.error(f"Error creating task: {e}")
+        logger.error("Error creating task: %s", e)
+        return None
+
+
+async def create_tasks(new_tasks: list[dict]):
+    """Insert several tasks with a single multi-row insert."""
+    try:
+        titles = encrypt_many([task.get("title") for task in new_tasks])
+        rows = [
+            {**task, "title": title} if "title" in task else task
+            for task, title in zip(new_tasks, titles)
+        ]
+
+        response = await supabase.table("tasks").insert(rows).execute()
+
+        if response.data:
+            _decrypt_titles(response.data)
+
+        return response.data
+    except Exception as e:
+        logger.error("Error creating %s tasks: %s", len(new_tasks), e)
         return None
 
 
 async def get_users_for_reminders():
     try:
-        response = (
+        response = await (
             supabase.table("UserSettings")
             .select("user_id, telegram_id, timezone_offset")
             .eq("notifications", True)
@@ -101,32 +242,58 @@ async def get_users_for_reminders():
         )
         return response.data
     except Exception as e:
-        logger.error(f"Error fetching users for reminders: {e}")
+        logger.error("Error fetching users for reminders: %s", e)
         return []
 
 
-async def get_tasks_for_reminder(
-    user_id: str, start_naive: datetime, end_naive: datetime
-):
+async def get_all_due_reminders():
+    """Fetch every task due for a reminder this minute in a single query.
+
+    Each row carries id, user_id, telegram_id, title and scheduled_time. Returns
+    None (rather than an empty list) if the get_due_reminders RPC fails, so
+    callers can fall back to the per-window queries.
+    """
     try:
-        response = (
-            supabase.table("tasks")
-            .select("title, scheduled_time")
-            .eq("user_id", user_id)
-            .eq("is_completed", False)
-            .gte("scheduled_time", start_naive.isoformat())
-            .lt("scheduled_time", end_naive.isoformat())
-            .execute()
-        )
-        if response.data:
-            for task in response.data:
-                if "title" in task:
-                    task["title"] = decrypt(task["title"])
+        response = await supabase.rpc("get_due_reminders", {}).execute()
+        tasks = response.data or []
+        _decrypt_titles(tasks)
+        return tasks
+    except Exception as e:
+        logger.error("Error fetching due reminders: %s", e)
+        return None
 
-        return response.data
+
+async def get_tasks_for_reminder_bulk(
+    user_ids: list[str], start_iso: str, end_iso: str
+) -> dict[str, list[dict]]:
+    """Fetch pending tasks in a reminder window for many users at once.
+
+    Users sharing the same local window are queried together with an IN-list,
+    chunked to keep PostgREST URLs short. The window bounds are naive ISO
+    strings, already serialized by the caller. Results are grouped by user_id.
+    """
+    out = {user_id: [] for user_id in user_ids}
+    try:
+        for i in range(0, len(user_ids), REMINDER_BATCH_SIZE):
+            batch = user_ids[i : i + REMINDER_BATCH_SIZE]
+            response = await (
+                supabase.table("tasks")
+                .select("id, user_id, title, scheduled_time")
+                .in_("user_id", batch)
+                .eq("is_completed", False)
+                .gte("scheduled_time", start_iso)
+                .lt("scheduled_time", end_iso)
+                .execute()
+            )
+            tasks = response.data or []
+            _decrypt_titles(tasks)
+            for task in tasks:
+                out[task["user_id"]].append(task)
+
+        return out
     except Exception as e:
-        logger.error(f"Error fetching tasks for reminder: {e}")
-        return []
+        logger.error("Error fetching tasks for reminder batch: %s", e)
+        return out
 
 
 async def fetch_external_events_for_user_in_range(
@@ -138,12 +305,12 @@ async def fetch_external_events_for_user_in_range(
     The title is NOT encrypted unlike regular tasks.
     """
     try:
-        logger.info(
-            f"Fetching external events for user {user_id} between {range_start.isoformat()} and {range_end.isoformat()}"
+        logger.debug(
+            "Fetching external events for user %s between %s and %s", user_id, range_start, range_end
         )
 
         # First get all calendar sources for this user
-        sources_response = (
+        sources_response = await (
             supabase.table("calendar_sources")
             .select("id")
             .eq("user_id", user_id)
@@ -151,15 +318,15 @@ async def fetch_external_events_for_user_in_range(
         )
 
         if not sources_response.data:
-            logger.info(f"No calendar sources found for user {user_id}")
+            logger.debug("No calendar sources found for user %s", user_id)
             return []
 
         source_ids = [source["id"] for source in sources_response.data]
 
         # Now fetch external events for these sources within the time range
-        events_response = (
+        events_response = await (
             supabase.table("external_events")
-            .select("*")
+            .select("title, start_time, end_time, all_day")
             .in_("source_id", source_ids)
             .gte("start_time", range_start.isoformat())
             .lt("start_time", range_end.isoformat())
@@ -169,5 +336,5 @@ async def fetch_external_events_for_user_in_range(
 
         return events_response.data or []
     except Exception as e:
-        logger.error(f"Error fetching external events for user {user_id}: {e}")
+        logger.error("Error fetching external events for user %s: %s", user_id, e)
         return []
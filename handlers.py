@@ -1,9 +1,12 @@
-import asyncio
+import html
 import logging
+import math
 import random
 import re
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+from itertools import islice
 
+from cachetools import TTLCache
 from telegram import Update
 from telegram.constants import ParseMode
 from telegram.ext import ContextTypes
@@ -13,165 +16,206 @@ import utils
 
 logger = logging.getLogger(__name__)
 
+# Serializes /schedule and task creation per chat. Updates are handled
+# concurrently, so this keeps a chat's task messages in order, and in a burst
+# of /schedule commands the first renders the reply and the rest are answered
+# from _schedule_cache instead of repeating the RPC
+_chat_locks = utils.KeyedLocks()
+
+# Rendered /schedule replies per chat as (timezone, local day, message).
+# Dropped when the bot changes the chat's tasks or timezone; edits made in
+# the Plazen app show up once the short TTL expires.
+_schedule_cache = TTLCache(maxsize=10_000, ttl=60)
+
+# (chat_id, message text) of task messages currently being saved, so a
+# duplicate submit of the same message isn't saved twice
+_task_messages_in_flight: set[tuple[str, str]] = set()
+
+# The duration group is lazy and the pattern is anchored, so a trailing
+# "at <time>" is captured by the optional group instead of being swallowed
+# into the duration
+_TASK_RE = re.compile(r"i want to (.*) for (.*?)(?: at (.*))?$", re.IGNORECASE)
+
+# Auto-scheduled tasks start on a 15-minute grid
+SLOT_STEP_SECONDS = 15 * 60
+
+_START_TEMPLATE = (
+    "Hi {mention}! Welcome to the Plazen Bot. 🤖"
+    "\n\n"
+    "To link this bot to your Plazen account, copy your Chat ID below and paste it into the 'Telegram Chat ID' field in your Plazen app's settings."
+    "\n\n"
+    "Your Telegram Chat ID is:"
+    "\n"
+    "<code>{chat_id}</code>"
+    "\n\n"
+    "Once linked, please use /timezone to set your local timezone, then /schedule to see your tasks."
+)
+
+_HELP_TEXT = (
+    "Available commands:\n"
+    "/start - Get your Telegram Chat ID to link your account.\n"
+    "/schedule - Get your schedule for today.\n"
+    "/timezone - Set your local timezone (e.g., /timezone -7)"
+)
+
+_TIMEZONE_USAGE_TEXT = (
+    "Please provide your timezone offset from UTC.\n\n"
+    "<b>Examples:</b>\n"
+    "<code>/timezone +5:30</code> (for India)\n"
+    "<code>/timezone -7</code> (for Mountain Time)\n"
+    "<code>/timezone +10</code> (for Sydney)\n"
+    "<code>/timezone 0</code> (for UTC/GMT)\n\n"
+    'You can google "my timezone offset" to find yours.'
+)
+
+_TIMEZONE_INVALID_TEXT = (
+    "<b>Invalid format.</b> 😕\n"
+    "Please use one of these formats:\n"
+    "<code>+5:30</code>\n"
+    "<code>-7</code>\n"
+    "<code>+09:00</code>\n"
+)
+
 
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user = update.effective_user
     chat_id = str(update.message.chat_id)
 
-    logger.info(f"User {user.first_name} (ID: {chat_id}) started the bot.")
+    logger.info("User %s (ID: %s) started the bot.", user.first_name, chat_id)
 
     await update.message.reply_html(
-        rf"Hi {user.mention_html()}! Welcome to the Plazen Bot. 🤖"
-        "\n\n"
-        "To link this bot to your Plazen account, copy your Chat ID below and paste it into the 'Telegram Chat ID' field in your Plazen app's settings."
-        "\n\n"
-        "Your Telegram Chat ID is:"
-        "\n"
-        f"<code>{chat_id}</code>"
-        "\n\n"
-        "Once linked, please use /timezone to set your local timezone, then /schedule to see your tasks."
+        _START_TEMPLATE.format(mention=user.mention_html(), chat_id=chat_id)
     )
 
 
 async def schedule_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     chat_id = str(update.message.chat_id)
-    logger.info(f"Received /schedule command from {chat_id}")
-
-    user_settings = await db.get_user_settings_by_telegram_chat_id(chat_id)
+    logger.info("Received /schedule command from %s", chat_id)
+
+    async with _chat_locks.hold(chat_id):
+        cached = _schedule_cache.get(chat_id)
+        if cached:
+            cached_timezone, cached_day, cached_message = cached
+            if datetime.now(cached_timezone).date() == cached_day:
+                await update.message.reply_html(cached_message)
+                return
 
-    if not user_settings or not user_settings.get("user_id"):
-        await update.message.reply_text(
-            "I don't recognize you. 😢\n"
-            "Please send /start to get your Chat ID, then add it to your Plazen app settings."
-        )
-        return
+        user_settings, tasks = await db.get_today_schedule(chat_id)
 
-    user_id = user_settings["user_id"]
-    user_timezone_str = user_settings.get("timezone_offset")
-    user_timezone = utils.parse_timezone_offset(user_timezone_str)
+        if not user_settings or not user_settings.get("user_id"):
+            await update.message.reply_text(
+                "I don't recognize you. 😢\n"
+                "Please send /start to get your Chat ID, then add it to your Plazen app settings."
+            )
+            return
 
-    if not user_timezone:
-        await update.message.reply_html(
-            "Please set your timezone first!\n"
-            "I need to know your timezone to find your schedule for 'today'.\n\n"
-            "Use <code>/timezone +5:30</code> or <code>/timezone -7</code>."
-        )
-        return
+        user_id = user_settings["user_id"]
+        user_timezone_str = user_settings.get("timezone_offset")
+        user_timezone = utils.parse_timezone_offset(user_timezone_str)
 
-    await update.message.reply_text("Checking your schedule for today...")
-    now_local = datetime.now(user_timezone)
-    range_start = now_local.replace(hour=0, minute=0, second=0, microsecond=0)
-    range_end = range_start + timedelta(days=1)
+        if not user_timezone:
+            await update.message.reply_html(
+                "Please set your timezone first!\n"
+                "I need to know your timezone to find your schedule for 'today'.\n\n"
+                "Use <code>/timezone +5:30</code> or <code>/timezone -7</code>."
+            )
+            return
 
-    tasks = await db.fetch_schedule_for_user_in_range(user_id, range_start, range_end)
-    external_events = await db.fetch_external_events_for_user_in_range(
-        user_id, range_start, range_end
-    )
+        await update.message.reply_text("Checking your schedule for today...")
+        now_local = datetime.now(user_timezone)
+        range_start = now_local.replace(hour=0, minute=0, second=0, microsecond=0)
+        range_end = range_start + timedelta(days=1)
 
-    if not tasks and not external_events:
-        await update.message.reply_text(
-            "You have no tasks or events scheduled for today. ✨"
+        external_events = await db.fetch_external_events_for_user_in_range(
+            user_id, range_start, range_end
         )
-        return
 
-    tz_label = user_timezone.tzname(None)
-    schedule_message = f"<b>Here is your schedule for today ({tz_label}):</b>\n\n"
+        if not tasks and not external_events:
+            await update.message.reply_text(
+                "You have no tasks or events scheduled for today. ✨"
+            )
+            return
 
-    # Build a combined list of items with normalized format
-    schedule_items = []
+        tz_label = user_timezone.tzname(None)
+        parts = [f"<b>Here is your schedule for today ({tz_label}):</b>", ""]
+
+        # Build a combined list of (sort_time, rendered line) pairs so each
+        # item is formatted exactly once
+        schedule_items = []
+
+        # Process regular tasks
+        for task in tasks:
+            scheduled_time = task.get("scheduled_time")
+            if scheduled_time:
+                task_time_local = utils.parse_supabase_ts(scheduled_time, user_timezone)
+                # Supabase returns "YYYY-MM-DDTHH:MM:SS...", so HH:MM can be sliced
+                # straight out of the string without going through strftime
+                if len(scheduled_time) >= 16:
+                    time_str = scheduled_time[11:16]
+                else:
+                    time_str = task_time_local.strftime("%H:%M")
+                sort_time = task_time_local
+            else:
+                time_str = "No time"
+                sort_time = datetime.max.replace(tzinfo=user_timezone)
+
+            status = "✅" if task.get("is_completed") else "🔲"
+            title = html.escape(task.get("title", "No Title"), quote=False)
+            duration = (
+                f"({task.get('duration_minutes')} min)"
+                if task.get("duration_minutes")
+                else ""
+            )
 
-    # Process regular tasks
-    for task in tasks:
-        if task.get("scheduled_time"):
-            task_time_db = datetime.fromisoformat(task["scheduled_time"])
-            task_time_naive = task_time_db.replace(tzinfo=None)
-            task_time_local = task_time_naive.replace(tzinfo=user_timezone)
-            time_str = task_time_local.strftime("%H:%M")
-            sort_time = task_time_local
-        else:
-            time_str = "No time"
-            sort_time = datetime.max.replace(tzinfo=user_timezone)
-
-        status = "✅" if task.get("is_completed") else "🔲"
-        title = (
-            task.get("title", "No Title")
-            .replace("<", "&lt;")
-            .replace(">", "&gt;")
-            .replace("&", "&amp;")
-        )
-        duration = (
-            f"({task.get('duration_minutes')} min)"
-            if task.get("duration_minutes")
-            else ""
-        )
+            schedule_items.append(
+                (sort_time, f"{status} <b>{time_str}</b> - {title} {duration}")
+            )
 
-        schedule_items.append(
-            {
-                "sort_time": sort_time,
-                "time_str": time_str,
-                "status": status,
-                "title": title,
-                "duration": duration,
-                "type": "task",
-            }
-        )
+        # Process external events (times are stored in UTC, need conversion to local)
+        for event in external_events:
+            if event.get("start_time"):
+                # External events are stored with timezone info (UTC)
+                event_time_utc = datetime.fromisoformat(event["start_time"])
+                # Convert to user's local timezone
+                event_time_local = event_time_utc.astimezone(user_timezone)
+                time_str = event_time_local.strftime("%H:%M")
+                sort_time = event_time_local
+
+                # Calculate duration if end_time exists
+                duration = ""
+                if event.get("end_time"):
+                    event_end_utc = datetime.fromisoformat(event["end_time"])
+                    duration_minutes = int(
+                        (event_end_utc - event_time_utc).total_seconds() / 60
+                    )
+                    if duration_minutes > 0:
+                        duration = f"({duration_minutes} min)"
+            else:
+                time_str = "No time"
+                sort_time = datetime.max.replace(tzinfo=user_timezone)
+                duration = ""
 
-    # Process external events (times are stored in UTC, need conversion to local)
-    for event in external_events:
-        if event.get("start_time"):
-            # External events are stored with timezone info (UTC)
-            event_time_utc = datetime.fromisoformat(event["start_time"])
-            # Convert to user's local timezone
-            event_time_local = event_time_utc.astimezone(user_timezone)
-            time_str = event_time_local.strftime("%H:%M")
-            sort_time = event_time_local
-
-            # Calculate duration if end_time exists
-            duration = ""
-            if event.get("end_time"):
-                event_end_utc = datetime.fromisoformat(event["end_time"])
-                duration_minutes = int(
-                    (event_end_utc - event_time_utc).total_seconds() / 60
-                )
-                if duration_minutes > 0:
-                    duration = f"({duration_minutes} min)"
-        else:
-            time_str = "No time"
-            sort_time = datetime.max.replace(tzinfo=user_timezone)
-            duration = ""
-
-        # External events don't have completion status, use calendar emoji
-        status = "📅"
-        title = (
-            event.get("title", "No Title")
-            .replace("<", "&lt;")
-            .replace(">", "&gt;")
-            .replace("&", "&amp;")
-        )
+            # External events don't have completion status, use calendar emoji
+            status = "📅"
+            title = html.escape(event.get("title", "No Title"), quote=False)
 
-        # Add all-day indicator if applicable
-        if event.get("all_day"):
-            time_str = "All day"
-
-        schedule_items.append(
-            {
-                "sort_time": sort_time,
-                "time_str": time_str,
-                "status": status,
-                "title": title,
-                "duration": duration,
-                "type": "event",
-            }
-        )
+            # Add all-day indicator if applicable
+            if event.get("all_day"):
+                time_str = "All day"
+
+            schedule_items.append(
+                (sort_time, f"{status} <b>{time_str}</b> - {title} {duration}")
+            )
 
-    # Sort all items by time
-    schedule_items.sort(key=lambda x: x["sort_time"])
+        # Sort all items by time
+        schedule_items.sort(key=lambda x: x[0])
 
-    # Build the message
-    for item in schedule_items:
-        schedule_message += f"{item['status']} <b>{item['time_str']}</b> - {item['title']} {item['duration']}\n"
+        # Build the message
+        parts.extend(line for _, line in schedule_items)
+        schedule_message = "\n".join(parts)
 
-    await update.message.reply_html(schedule_message)
+        _schedule_cache[chat_id] = (user_timezone, range_start.date(), schedule_message)
+        await update.message.reply_html(schedule_message)
 
 
 async def timezone_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -179,28 +223,14 @@ async def timezone_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -
     args = context.args
 
     if not args:
-        await update.message.reply_html(
-            "Please provide your timezone offset from UTC.\n\n"
-            "<b>Examples:</b>\n"
-            "<code>/timezone +5:30</code> (for India)\n"
-            "<code>/timezone -7</code> (for Mountain Time)\n"
-            "<code>/timezone +10</code> (for Sydney)\n"
-            "<code>/timezone 0</code> (for UTC/GMT)\n\n"
-            'You can google "my timezone offset" to find yours.'
-        )
+        await update.message.reply_html(_TIMEZONE_USAGE_TEXT)
         return
 
     offset_str = args[0]
     user_timezone = utils.parse_timezone_offset(offset_str)
 
     if user_timezone is None:
-        await update.message.reply_html(
-            "<b>Invalid format.</b> 😕\n"
-            "Please use one of these formats:\n"
-            "<code>+5:30</code>\n"
-            "<code>-7</code>\n"
-            "<code>+09:00</code>\n"
-        )
+        await update.message.reply_html(_TIMEZONE_INVALID_TEXT)
         return
 
     try:
@@ -208,7 +238,7 @@ async def timezone_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -
 
         if not response_data:
             logger.warning(
-                f"No UserSettings row found for chat_id {chat_id} during timezone update."
+                "No UserSettings row found for chat_id %s during timezone update.", chat_id
             )
             await update.message.reply_text(
                 "I couldn't find your user account. 😢\n"
@@ -216,244 +246,341 @@ async def timezone_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -
             )
             return
 
+        _schedule_cache.pop(chat_id, None)
         await update.message.reply_html(
             f"Success! Your timezone is set to <b>UTC{offset_str}</b>. 🎉"
         )
 
     except Exception as e:
-        logger.error(f"Error during timezone_command for chat_id {chat_id}: {e}")
+        logger.error("Error during timezone_command for chat_id %s: %s", chat_id, e)
         await update.message.reply_text(
             "An error occurred while trying to save your timezone. Please try again."
         )
 
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    await update.message.reply_text(
-        "Available commands:\n"
-        "/start - Get your Telegram Chat ID to link your account.\n"
-        "/schedule - Get your schedule for today.\n"
-        "/timezone - Set your local timezone (e.g., /timezone -7)"
-    )
+    await update.message.reply_text(_HELP_TEXT)
 
 
-async def handle_ai_task_creation(
-    update: Update, context: ContextTypes.DEFAULT_TYPE
-) -> None:
-    chat_id = str(update.message.chat_id)
-    text = update.message.text
-
-    if "task_lock" not in context.user_data:
-        context.user_data["task_lock"] = asyncio.Lock()
-    lock = context.user_data["task_lock"]
+async def _fetch_busy_today(user_settings: dict, user_timezone: timezone) -> list:
+    """Return the (start, end) local times of the user's tasks in today's timetable."""
+    user_start_hour_int = user_settings.get("timetable_start")
+    user_end_hour_int = user_settings.get("timetable_end")
 
-    async with lock:
-        logger.info(f"Acquired task lock for chat_id {chat_id}")
+    # _plan_task asks the user to set their timetable before auto-scheduling
+    if user_start_hour_int is None or user_end_hour_int is None:
+        return []
 
-        match = re.match(r"i want to (.*) for (.*)(?: at (.*))?", text, re.IGNORECASE)
+    local_now = datetime.now(user_timezone)
+    range_start_naive = local_now.replace(
+        hour=user_start_hour_int, minute=0, second=0, microsecond=0, tzinfo=None
+    )
+    range_end_naive = local_now.replace(
+        hour=user_end_hour_int, minute=0, second=0, microsecond=0, tzinfo=None
+    )
 
-        if not match:
-            logger.info(f"Ignoring non-task message from {chat_id}")
-            return
+    # This DB query MUST use naive datetimes to match the DB column
+    existing_tasks_raw = await db.fetch_schedule_for_user_in_range(
+        user_settings["user_id"], range_start_naive, range_end_naive
+    )
 
-        logger.info(f"Matched task creation syntax from {chat_id}")
+    busy = []
+    for task in existing_tasks_raw:
+        try:
+            # Stored times are local wall-clock times (e.g. 18:45 comes back
+            # as 18:45+00:00), so reinterpret them in the user's timezone
+            task_start_local = utils.parse_supabase_ts(
+                task["scheduled_time"], user_timezone
+            )
 
-        user_settings = await db.get_user_settings_by_telegram_chat_id(chat_id)
+            task_duration = task.get("duration_minutes") or 30
 
-        if not user_settings or not user_settings.get("user_id"):
-            await update.message.reply_text(
-                "I can't schedule this for you until I know who you are. 😢\n"
-                "Please send /start to get your Chat ID, then add it to your Plazen app settings."
+            # Calculate end time in the same local timezone
+            task_end_local = task_start_local + timedelta(
+                minutes=task_duration
             )
-            return
 
-        user_id = user_settings["user_id"]
-        user_timezone_str = user_settings.get("timezone_offset")
-        user_timezone = utils.parse_timezone_offset(user_timezone_str)
+            busy.append((task_start_local, task_end_local))
 
-        if not user_timezone:
-            await update.message.reply_html(
-                "I can't schedule this for you until I know your timezone!\n"
-                "Please set your timezone first using <code>/timezone +5:30</code> or <code>/timezone -7</code>."
+            logger.debug(
+                "Existing task parsed (local): %s to %s", task_start_local, task_end_local
             )
-            return
 
-        try:
-            title = match.group(1).strip().capitalize()
-            duration_str = match.group(2).strip()
-            time_str = match.group(3).strip() if match.group(3) else None
+        except Exception as e:
+            logger.warning(
+                "Could not parse existing task %s: %s", task.get('id'), e
+            )
 
-            if not title:
-                await update.message.reply_text("Please provide a title for the task.")
-                return
+    return busy
 
-            duration_minutes = utils.parse_duration_to_minutes(duration_str)
-            if duration_minutes is None:
-                await update.message.reply_html(
-                    f"I didn't understand the duration <b>'{duration_str}'</b>.\n"
-                    "Please try '30 min', '1 hour', '120m', or '2 hours'."
-                )
-                return
 
-            task_dt_naive = None
-            local_time_str = ""
+async def _plan_task(
+    update: Update,
+    match: re.Match,
+    user_settings: dict,
+    user_timezone: timezone,
+    busy: list,
+):
+    """Resolve one matched task line into a new task row.
 
-            if time_str:
-                logger.info(f"User provided specific time: {time_str}")
-                task_dt_naive = utils.parse_local_time_to_naive_datetime(
-                    time_str, user_timezone
-                )
-                if task_dt_naive is None:
-                    await update.message.reply_html(
-                        f"I didn't understand the time <b>'{time_str}'</b>.\n"
-                        "Please try '17:30' or '5:30PM'."
-                    )
-                    return
-                local_time_str = task_dt_naive.strftime("%H:%M on %b %d")
+    busy holds the (start, end) local times already taken today, from
+    _fetch_busy_today plus anything planned earlier in the same message.
+    Returns (new_task, local_time_str), or None after replying to the user
+    when the line can't be scheduled.
+    """
+    user_id = user_settings["user_id"]
 
-            else:
-                logger.info(
-                    f"User did not provide time for '{title}', finding random slot for today."
-                )
+    title = match.group(1).strip().capitalize()
+    duration_str = match.group(2).strip()
+    time_str = match.group(3).strip() if match.group(3) else None
 
-                user_start_hour_int = user_settings.get("timetable_start")
-                user_end_hour_int = user_settings.get("timetable_end")
+    if not title:
+        await update.message.reply_text("Please provide a title for the task.")
+        return None
 
-                if user_start_hour_int is None or user_end_hour_int is None:
-                    await update.message.reply_html(
-                        "To auto-schedule, please set your <b>start and end times</b> in the Plazen app's settings first."
-                    )
-                    return
+    duration_minutes = utils.parse_duration_to_minutes(duration_str)
+    if duration_minutes is None:
+        await update.message.reply_html(
+            f"I didn't understand the duration <b>'{duration_str}'</b>.\n"
+            "Please try '30 min', '1 hour', '120m', or '2 hours'."
+        )
+        return None
 
-                now_local = datetime.now(user_timezone)
+    task_dt_naive = None
+    local_time_str = ""
 
-                today_start_dt = now_local.replace(
-                    hour=user_start_hour_int, minute=0, second=0, microsecond=0
-                )
-                today_end_dt = now_local.replace(
-                    hour=user_end_hour_int, minute=0, second=0, microsecond=0
-                )
+    if time_str:
+        logger.debug("User provided specific time: %s", time_str)
+        task_dt_naive = utils.parse_local_time_to_naive_datetime(
+            time_str, user_timezone
+        )
+        if task_dt_naive is None:
+            await update.message.reply_html(
+                f"I didn't understand the time <b>'{time_str}'</b>.\n"
+                "Please try '17:30' or '5:30PM'."
+            )
+            return None
+        local_time_str = task_dt_naive.strftime("%H:%M on %b %d")
 
-                range_start_naive = today_start_dt.replace(tzinfo=None)
-                range_end_naive = today_end_dt.replace(tzinfo=None)
+    else:
+        logger.debug(
+            "User did not provide time for '%s', finding random slot for today.", title
+        )
 
-                # This DB query MUST use naive datetimes to match the DB column
-                existing_tasks_raw = await db.fetch_schedule_for_user_in_range(
-                    user_id, range_start_naive, range_end_naive
-                )
+        user_start_hour_int = user_settings.get("timetable_start")
+        user_end_hour_int = user_settings.get("timetable_end")
 
-                parsed_tasks_list = []
-                for task in existing_tasks_raw:
-                    try:
-                        # 1. Parse the UTC datetime string from Supabase (e.g., 18:45+00:00)
-                        task_start_db_time = datetime.fromisoformat(
-                            task["scheduled_time"]
-                        )
+        if user_start_hour_int is None or user_end_hour_int is None:
+            await update.message.reply_html(
+                "To auto-schedule, please set your <b>start and end times</b> in the Plazen app's settings first."
+            )
+            return None
 
-                        # 2. Get the naive time (e.g., 18:45)
-                        task_start_naive = task_start_db_time.replace(tzinfo=None)
+        now_local = datetime.now(user_timezone)
 
-                        # 3. Apply the user's local timezone (e.g., 18:45 UTC+4)
-                        task_start_local = task_start_naive.replace(
-                            tzinfo=user_timezone
-                        )
+        today_start_dt = now_local.replace(
+            hour=user_start_hour_int, minute=0, second=0, microsecond=0
+        )
+        today_end_dt = now_local.replace(
+            hour=user_end_hour_int, minute=0, second=0, microsecond=0
+        )
 
-                        task_duration = task.get("duration_minutes") or 30
+        # The sweep works on integer epoch seconds so the hot loop doesn't
+        # allocate a datetime per 15-minute step. Sorted by start so it only
+        # has to look at tasks that can still overlap the current slot.
+        busy_ts = sorted(
+            (int(task_start.timestamp()), int(task_end.timestamp()))
+            for task_start, task_end in busy
+        )
+        first_live_task = 0
+
+        # Pick a free slot uniformly at random without building the list of
+        # all free slots (reservoir sampling with a reservoir of one)
+        found_slot_ts = None
+        valid_slot_count = 0
+
+        # First slot is the next 15-minute boundary in the user's local time
+        offset_s = int(user_timezone.utcoffset(None).total_seconds())
+        search_start_ts = max(now_local, today_start_dt).timestamp()
+        first_slot_ts = (
+            math.ceil((search_start_ts + offset_s) / SLOT_STEP_SECONDS)
+            * SLOT_STEP_SECONDS
+            - offset_s
+        )
+        end_ts = int(today_end_dt.timestamp())
+        duration_s = duration_minutes * 60
+
+        # Slots must finish by the end of the day
+        last_slot_ts = min(end_ts - 1, end_ts - duration_s)
+
+        for slot_start in range(first_slot_ts, last_slot_ts + 1, SLOT_STEP_SECONDS):
+            slot_end = slot_start + duration_s
+
+            # Tasks that ended before this slot also end before every later one
+            while first_live_task < len(busy_ts) and busy_ts[first_live_task][1] <= slot_start:
+                first_live_task += 1
+
+            is_conflict = False
+            for task_start, task_end in islice(busy_ts, first_live_task, None):
+                if task_start >= slot_end:
+                    break  # This and all later tasks start after the slot
+                if slot_start < task_end:
+                    is_conflict = True
+                    break
+
+            if not is_conflict:
+                valid_slot_count += 1
+                if random.randrange(valid_slot_count) == 0:
+                    found_slot_ts = slot_start
+
+        found_slot_dt = (
+            datetime.fromtimestamp(found_slot_ts, user_timezone)
+            if found_slot_ts is not None
+            else None
+        )
 
-                        # 4. Calculate end time in the same local timezone
-                        task_end_local = task_start_local + timedelta(
-                            minutes=task_duration
-                        )
+        if found_slot_dt:
+            logger.debug(
+                "Found %s valid random slots for today.", valid_slot_count
+            )
+            # We store the *naive* version, as the DB expects this
+            task_dt_naive = found_slot_dt.replace(tzinfo=None)
+            local_time_str = found_slot_dt.strftime("%H:%M on %b %d")
+        else:
+            logger.warning(
+                "Could not find any free slots for user %s today.", user_id
+            )
+            await update.message.reply_html(
+                f"I couldn't find any free slots for <b>{duration_minutes} minutes</b> today. 😥\n"
+                "Please try a shorter duration or schedule it manually (e.g., '...at 7pm')."
+            )
+            return None
 
-                        parsed_tasks_list.append((task_start_local, task_end_local))
+    new_task = {
+        "user_id": user_id,
+        "title": title,
+        "scheduled_time": task_dt_naive.isoformat(),
+        "duration_minutes": duration_minutes,
+        "is_completed": False,
+    }
 
-                        logger.info(
-                            f"Existing task parsed (local): {task_start_local} to {task_end_local}"
-                        )
+    return new_task, local_time_str
 
-                    except Exception as e:
-                        logger.warning(
-                            f"Could not parse existing task {task.get('id')}: {e}"
-                        )
 
-                valid_slots = []
+async def handle_ai_task_creation(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+) -> None:
+    chat_id = str(update.message.chat_id)
+    text = update.message.text
 
-                search_start_time = max(now_local, today_start_dt)
+    # Cheap prefix check so ordinary chat never runs the regex or hits the DB
+    if not text or text[:10].lower() != "i want to ":
+        return
 
-                current_slot_start = search_start_time.replace(second=0, microsecond=0)
-                if search_start_time.second > 0 or search_start_time.microsecond > 0:
-                    current_slot_start += timedelta(minutes=1)
+    # A resend of a message that is still being saved is a duplicate submit
+    in_flight_key = (chat_id, text)
+    if in_flight_key in _task_messages_in_flight:
+        logger.info("Ignoring duplicate task message from %s", chat_id)
+        await update.message.reply_text(
+            "I'm still saving that task, one moment... ⏳"
+        )
+        return
 
-                minutes_past_interval = current_slot_start.minute % 15
-                if minutes_past_interval > 0:
-                    current_slot_start += timedelta(
-                        minutes=(15 - minutes_past_interval)
-                    )
+    _task_messages_in_flight.add(in_flight_key)
+    try:
+        # Updates are dispatched concurrently, so distinct task messages from
+        # the same chat wait their turn here rather than racing each other
+        async with _chat_locks.hold(chat_id):
+            # Several tasks can be sent at once, one "I want to ..." per line
+            matches = [
+                match
+                for match in (_TASK_RE.match(line.strip()) for line in text.splitlines())
+                if match
+            ]
+
+            if not matches:
+                logger.debug("Ignoring non-task message from %s", chat_id)
+                return
 
-                while current_slot_start < today_end_dt:
-                    slot_start = current_slot_start
-                    slot_end = slot_start + timedelta(minutes=duration_minutes)
+            logger.info("Matched %s task line(s) from %s", len(matches), chat_id)
 
-                    if slot_end > today_end_dt:
-                        break  # Slot finishes after end of day
+            user_settings = await db.get_user_settings_by_telegram_chat_id(chat_id)
 
-                    is_conflict = False
-                    for task_start, task_end in parsed_tasks_list:
-                        # This comparison will now work (local vs local)
-                        if (slot_start < task_end) and (slot_end > task_start):
-                            is_conflict = True
-                            break
+            if not user_settings or not user_settings.get("user_id"):
+                await update.message.reply_text(
+                    "I can't schedule this for you until I know who you are. 😢\n"
+                    "Please send /start to get your Chat ID, then add it to your Plazen app settings."
+                )
+                return
 
-                    if not is_conflict:
-                        valid_slots.append(slot_start)
+            user_timezone_str = user_settings.get("timezone_offset")
+            user_timezone = utils.parse_timezone_offset(user_timezone_str)
+
+            if not user_timezone:
+                await update.message.reply_html(
+                    "I can't schedule this for you until I know your timezone!\n"
+                    "Please set your timezone first using <code>/timezone +5:30</code> or <code>/timezone -7</code>."
+                )
+                return
 
-                    current_slot_start += timedelta(minutes=15)
+            try:
+                new_tasks = []
+                summaries = []
 
-                if valid_slots:
-                    logger.info(
-                        f"Found {len(valid_slots)} valid random slots for today."
+                # Today's tasks are fetched once per message, and only when a
+                # line needs a slot picked for it
+                busy = []
+                if any(not match.group(3) for match in matches):
+                    busy = await _fetch_busy_today(user_settings, user_timezone)
+
+                for match in matches:
+                    plan = await _plan_task(
+                        update, match, user_settings, user_timezone, busy
                     )
-                    found_slot_dt = random.choice(valid_slots)
-                    # We store the *naive* version, as the DB expects this
-                    task_dt_naive = found_slot_dt.replace(tzinfo=None)
-                    local_time_str = found_slot_dt.strftime("%H:%M on %b %d")
-                else:
-                    logger.warning(
-                        f"Could not find any free slots for user {user_id} today."
+                    if plan is None:
+                        return
+
+                    new_task, local_time_str = plan
+                    new_tasks.append(new_task)
+                    summaries.append(
+                        f"<b>Task:</b> {html.escape(new_task['title'], quote=False)}\n"
+                        f"<b>When:</b> {local_time_str} ({user_timezone.tzname(None)})\n"
+                        f"<b>Duration:</b> {new_task['duration_minutes']} minutes"
                     )
-                    await update.message.reply_html(
-                        f"I couldn't find any free slots for <b>{duration_minutes} minutes</b> today. 😥\n"
-                        "Please try a shorter duration or schedule it manually (e.g., '...at 7pm')."
+
+                    # Later lines must not be given this task's slot
+                    task_start_local = utils.parse_supabase_ts(
+                        new_task["scheduled_time"], user_timezone
                     )
-                    return
+                    busy.append(
+                        (
+                            task_start_local,
+                            task_start_local
+                            + timedelta(minutes=new_task["duration_minutes"]),
+                        )
+                    )
+
+                if len(new_tasks) == 1:
+                    created_task_data = await db.create_task(new_tasks[0])
+                    header = "<b>Task Scheduled!</b> 👍"
+                else:
+                    created_task_data = await db.create_tasks(new_tasks)
+                    header = f"<b>{len(new_tasks)} Tasks Scheduled!</b> 👍"
 
-            new_task = {
-                "user_id": user_id,
-                "title": title,
-                "scheduled_time": task_dt_naive.isoformat(),
-                "duration_minutes": duration_minutes,
-                "is_completed": False,
-            }
+                if not created_task_data:
+                    await update.message.reply_text(
+                        "Oops! Something went wrong and I couldn't save the task. Please try again."
+                    )
+                    return
 
-            created_task_data = await db.create_task(new_task)
+                _schedule_cache.pop(chat_id, None)
+                await update.message.reply_html("\n\n".join([header, *summaries]))
 
-            if not created_task_data:
+            except Exception as e:
+                logger.error("Error in handle_ai_task_creation for chat %s: %s", chat_id, e)
                 await update.message.reply_text(
-                    "Oops! Something went wrong and I couldn't save the task. Please try again."
+                    "Oops! Something went wrong while trying to schedule that. Please try again."
                 )
-                return
-
-            await update.message.reply_html(
-                f"<b>Task Scheduled!</b> 👍\n\n"
-                f"<b>Task:</b> {title.replace('<', '&lt;').replace('>', '&gt;')}\n"
-                f"<b>When:</b> {local_time_str} ({user_timezone.tzname(None)})\n"
-                f"<b>Duration:</b> {duration_minutes} minutes"
-            )
-
-        except Exception as e:
-            logger.error(f"Error in handle_ai_task_creation for chat {chat_id}: {e}")
-            await update.message.reply_text(
-                "Oops! Something went wrong while trying to schedule that. Please try again."
-            )
 
-        finally:
-            logger.info(f"Released task lock for chat_id {chat_id}")
+    finally:
+        _task_messages_in_flight.discard(in_flight_key)
\ No newline at end of file
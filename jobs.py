@@ -1,69 +1,149 @@
+import asyncio
+import html
 import logging
-from datetime import datetime, timedelta
-from telegram.ext import Application
+import time
+from datetime import timedelta
+from cachetools import TTLCache
+from telegram.ext import Application, ContextTypes
 from telegram.constants import ParseMode
 import db
 import utils
 
 logger = logging.getLogger(__name__)
 
+# Upper bound on reminder messages in flight at once, matching Telegram's
+# global limit of about 30 messages per second.
+REMINDER_CONCURRENCY = 30
+
+# (user_id, task_id) of recently sent reminders, so a tick that runs late or
+# twice for the same minute never reminds about a task again
+_sent_reminders = TTLCache(maxsize=4096, ttl=300)
+
+
+def _format_reminder(task: dict) -> str:
+    title = html.escape(task.get("title", "No Title"), quote=False)
+    
+    # HH:MM sits at a fixed offset in the ISO timestamp, so no parse is needed
+    scheduled_time = task["scheduled_time"]
+    if len(scheduled_time) >= 16:
+        time_str = scheduled_time[11:16]
+    else:
+        time_str = utils.parse_supabase_ts(scheduled_time).strftime('%H:%M')
+
+    return (
+        f"🔔 <b>Reminder!</b>\n\n"
+        f"Your task is starting in 30 minutes (at {time_str}):\n"
+        f"<b>{title}</b>"
+    )
+
+
+async def _send_reminder(application: Application, sem: asyncio.Semaphore, chat_id: str, message: str) -> None:
+    async with sem:
+        await application.bot.send_message(
+            chat_id=chat_id,
+            text=message,
+            parse_mode=ParseMode.HTML
+        )
+    logger.debug("Sent reminder to chat_id %s", chat_id)
+
+
+async def _fetch_due_reminders_per_window() -> list[dict]:
+    """Fallback for when the get_due_reminders RPC is unavailable."""
+    users = await db.get_users_for_reminders()
+    
+    if not users:
+        logger.info("No users have notifications enabled. Skipping reminder check.")
+        return []
+
+    # Users in the same timezone share the same naive reminder window, so
+    # group them by timezone and fetch each window's tasks with a single
+    # query. The window is computed and serialized once per timezone.
+    users_by_timezone = {}
+    chat_ids = {}
+    for user in users:
+        user_id = user.get('user_id')
+        chat_id = user.get('telegram_id')
+        user_timezone = utils.parse_timezone_offset(user.get('timezone_offset'))
+
+        if not (user_id and chat_id and user_timezone):
+            logger.warning("Skipping reminders for user %s: missing chat_id or timezone.", user_id)
+            continue
+
+        users_by_timezone.setdefault(user_timezone, []).append(user_id)
+        chat_ids[user_id] = chat_id
+
+    # One clock read for the whole cycle, shared by every timezone
+    now_ts = time.time()
+    windows = {}
+    for user_timezone, user_ids in users_by_timezone.items():
+        # Round to the nearest minute so a tick firing slightly early
+        # still lands on the intended window
+        now_local = utils.now_local(user_timezone, now_ts + 30)
+        now_rounded = now_local.replace(second=0, microsecond=0)
+
+        reminder_start_time = now_rounded + timedelta(minutes=30)
+        reminder_end_time = reminder_start_time + timedelta(minutes=1)
+
+        start_iso = reminder_start_time.replace(tzinfo=None).isoformat()
+        end_iso = reminder_end_time.replace(tzinfo=None).isoformat()
+
+        # Different offset strings (e.g. "+5" and "+05:00") can still
+        # land on the same window
+        windows.setdefault((start_iso, end_iso), []).extend(user_ids)
+
+    due = []
+    for (start_iso, end_iso), user_ids in windows.items():
+        tasks_by_user = await db.get_tasks_for_reminder_bulk(user_ids, start_iso, end_iso)
+
+        for user_id, tasks in tasks_by_user.items():
+            for task in tasks:
+                task["telegram_id"] = chat_ids[user_id]
+                due.append(task)
+
+    return due
+
+
 async def check_and_send_reminders(application: Application) -> None:
     logger.info("Checking for task reminders...")
     
     try:
-        users = await db.get_users_for_reminders()
-        
-        if not users:
-            logger.info("No users have notifications enabled. Skipping reminder check.")
-            return
-
-        for user in users:
-            user_id = user.get('user_id')
-            chat_id = user.get('telegram_id')
-            user_timezone = utils.parse_timezone_offset(user.get('timezone_offset'))
-
-            if not (user_id and chat_id and user_timezone):
-                logger.warning(f"Skipping reminders for user {user_id}: missing chat_id or timezone.")
-                continue
+        due = await db.get_all_due_reminders()
+        if due is None:
+            due = await _fetch_due_reminders_per_window()
 
+        reminders = []
+        for task in due:
+            key = (task.get("user_id"), task.get("id"))
+            if key in _sent_reminders:
+                logger.debug("Skipping already sent reminder for task %s", key[1])
+                continue
             try:
-                now_local = datetime.now(user_timezone)
-                now_rounded = now_local.replace(second=0, microsecond=0)
-                
-                reminder_start_time = now_rounded + timedelta(minutes=30)
-                reminder_end_time = reminder_start_time + timedelta(minutes=1)
-
-                reminder_start_naive = reminder_start_time.replace(tzinfo=None)
-                reminder_end_naive = reminder_end_time.replace(tzinfo=None)
-
-                tasks = await db.get_tasks_for_reminder(user_id, reminder_start_naive, reminder_end_naive)
-
-                if not tasks:
-                    continue 
-
-                logger.info(f"Found {len(tasks)} tasks for user {user_id} needing reminders.")
-
-                for task in tasks:
-                    title = task.get("title", "No Title").replace('<', '&lt;').replace('>', '&gt;').replace('&', '&amp;')
-                    
-                    task_time_local = datetime.fromisoformat(task["scheduled_time"])
-                    time_str = task_time_local.strftime('%H:%M')
-
-                    message = (
-                        f"🔔 <b>Reminder!</b>\n\n"
-                        f"Your task is starting in 30 minutes (at {time_str}):\n"
-                        f"<b>{title}</b>"
-                    )
-                    
-                    await application.bot.send_message(
-                        chat_id=chat_id,
-                        text=message,
-                        parse_mode=ParseMode.HTML
-                    )
-                    logger.info(f"Sent reminder for task '{title}' to chat_id {chat_id}")
-
+                reminders.append((task["telegram_id"], _format_reminder(task)))
             except Exception as e:
-                logger.error(f"Error processing reminders for user {user_id}: {e}")
+                logger.error("Error preparing reminder for user %s: %s", task.get('user_id'), e)
+                continue
+            if key[1] is not None:
+                _sent_reminders[key] = True
+
+        if reminders:
+            logger.info("Sending %s task reminders.", len(reminders))
+
+        sem = asyncio.Semaphore(REMINDER_CONCURRENCY)
+        results = await asyncio.gather(
+            *(_send_reminder(application, sem, chat_id, message) for chat_id, message in reminders),
+            return_exceptions=True,
+        )
+        for (chat_id, _), result in zip(reminders, results):
+            if isinstance(result, Exception):
+                logger.error("Error sending reminder to chat_id %s: %s", chat_id, result)
 
     except Exception as e:
-        logger.error(f"Error during reminder check cycle: {e}")
\ No newline at end of file
+        logger.error("Error during reminder check cycle: %s", e)
+
+
+async def check_and_send_reminders_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    await check_and_send_reminders(context.application)
+
+
+async def refresh_user_settings_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    await db.refresh_user_settings_cache()
\ No newline at end of file
@@ -1,7 +1,11 @@
 import asyncio
 import logging
+import queue
+import time
+from logging.handlers import QueueHandler, QueueListener
 from telegram import Update
 from telegram.ext import (
+    AIORateLimiter,
     Application,
     CommandHandler,
     ContextTypes,
@@ -16,9 +20,30 @@ import jobs
 
 logger = logging.getLogger(__name__)
 
+def start_log_listener() -> QueueListener:
+    # Route all records through a queue so the event loop never blocks on a
+    # slow stderr; the configured handlers run on the listener's thread
+    root = logging.getLogger()
+    log_queue = queue.Queue(-1)
+    listener = QueueListener(log_queue, *root.handlers, respect_handler_level=True)
+    root.handlers = [QueueHandler(log_queue)]
+    listener.start()
+    return listener
+
 async def main() -> None:
-    # Use the token from the config file
-    application = Application.builder().token(config.TELEGRAM_TOKEN).build()
+    # Use the token from the config file. Updates are handled concurrently
+    # (per-chat ordering is enforced inside the handlers), and outgoing
+    # messages go through a rate limiter so reminder fan-out stays within
+    # Telegram's 30 msg/s cap.
+    application = (
+        Application.builder()
+        .token(config.TELEGRAM_TOKEN)
+        .concurrent_updates(True)
+        .rate_limiter(AIORateLimiter(overall_max_rate=30, overall_time_period=1))
+        .connection_pool_size(64)
+        .pool_timeout(20)
+        .build()
+    )
     
     # Add handlers from the handlers.py file
     application.add_handler(CommandHandler("start", handlers.start_command))
@@ -28,6 +53,16 @@ async def main() -> None:
     
     # Add the message handler for AI task creation
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handlers.handle_ai_task_creation))
+
+    # Check for reminders every minute on PTB's JobQueue, which keeps a fixed
+    # period regardless of how long each check takes. The first run is
+    # aligned to the next minute boundary, matching the one-minute windows.
+    application.job_queue.run_repeating(
+        jobs.check_and_send_reminders_job, interval=60, first=60 - time.time() % 60
+    )
+
+    # Keep the in-process UserSettings snapshot fresh
+    application.job_queue.run_repeating(jobs.refresh_user_settings_job, interval=300, first=0)
     
     try:
         logger.info("Initializing application...")
@@ -37,17 +72,13 @@ async def main() -> None:
         await application.start()
         await application.updater.start_polling(allowed_updates=Update.ALL_TYPES)
         
-        # Main loop for running background jobs
-        while True:
-            # Run the reminder check from jobs.py
-            await jobs.check_and_send_reminders(application)
-            # Wait 60 seconds before checking again
-            await asyncio.sleep(60) 
+        # Keep running until the process is stopped
+        await asyncio.Event().wait()
             
     except (KeyboardInterrupt, SystemExit):
         logger.info("Bot stopped by user.")
     except Exception as e:
-        logger.error(f"Bot polling failed unexpectedly: {e}")
+        logger.error("Bot polling failed unexpectedly: %s", e)
     finally:
         if application.updater and application.updater.is_running:
             logger.info("Stopping updater...")
@@ -56,14 +87,19 @@ async def main() -> None:
             logger.info("Stopping application...")
             await application.stop()
         logger.info("Shutting down application...")
-        await application.shutdown() 
+        await application.shutdown()
+        # Release the pooled Supabase connections
+        await config.http_client.aclose()
         logger.info("Bot shut down successfully.")
 
 
 if __name__ == "__main__":
+    log_listener = start_log_listener()
     try:
         asyncio.run(main())
     except (KeyboardInterrupt, SystemExit):
         logger.info("Bot shutting down (main entry).")
     except Exception as e:
-        logger.error(f"Application failed to run: {e}")
\ No newline at end of file
+        logger.error("Application failed to run: %s", e)
+    finally:
+        log_listener.stop()
\ No newline at end of file
@@ -0,0 +1,67 @@
+-- Returns a chat's UserSettings row together with the tasks for its local
+-- "today" in a single round-trip. The day boundaries are derived from the
+-- stored timezone_offset (same formats and limits as
+-- utils.parse_timezone_offset), and tasks.scheduled_time holds naive local
+-- wall-clock times.
+create or replace function get_today_schedule(p_chat_id text)
+returns json
+language sql
+stable
+as $$
+  with settings as (
+    select
+      s.user_id,
+      s.timezone_offset,
+      s.timetable_start,
+      s.timetable_end,
+      regexp_match(s.timezone_offset, '^([+-])(\d{1,2})(?::?(\d{2}))?$') as tz
+    from "UserSettings" s
+    where s.telegram_id = p_chat_id
+    limit 1
+  ),
+  day as (
+    select
+      settings.user_id,
+      date_trunc(
+        'day',
+        (now() at time zone 'UTC')
+          + (settings.tz[1] || '1')::int
+            * make_interval(hours => settings.tz[2]::int, mins => coalesce(settings.tz[3], '0')::int)
+      ) as day_start
+    from settings
+    where settings.tz is not null
+      and settings.tz[2]::int <= 14
+      and coalesce(settings.tz[3], '0')::int <= 59
+  )
+  select json_build_object(
+    'settings', (
+      select json_build_object(
+        'user_id', settings.user_id,
+        'timezone_offset', settings.timezone_offset,
+        'timetable_start', settings.timetable_start,
+        'timetable_end', settings.timetable_end
+      )
+      from settings
+    ),
+    'tasks', coalesce((
+      select json_agg(
+        json_build_object(
+          'id', t.id,
+          'scheduled_time', t.scheduled_time,
+          'is_completed', t.is_completed,
+          'title', t.title,
+          'duration_minutes', t.duration_minutes
+        )
+        order by t.scheduled_time
+      )
+      from day
+      join tasks t on t.user_id = day.user_id
+      where t.scheduled_time >= day.day_start
+        and t.scheduled_time < day.day_start + interval '1 day'
+    ), '[]'::json)
+  );
+$$;
+
+-- Only the bot's service role may call this; anon and authenticated users
+-- could otherwise read any chat's tasks through PostgREST.
+revoke execute on function get_today_schedule(text) from public, anon, authenticated;
@@ -0,0 +1,11 @@
+-- Schedule view: user_id + scheduled_time range. The INCLUDE columns let
+-- the schedule query be answered with an index-only scan.
+create index if not exists tasks_user_time_idx
+  on tasks (user_id, scheduled_time)
+  include (title, is_completed, duration_minutes);
+
+-- Reminders: only pending tasks are ever looked up, so a partial index keeps
+-- that working set small.
+create index if not exists tasks_user_pending_time_idx
+  on tasks (user_id, scheduled_time)
+  where is_completed = false;
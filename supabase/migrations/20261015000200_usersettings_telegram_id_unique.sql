@@ -0,0 +1,4 @@
+-- Each Telegram chat links to at most one account; the unique index also
+-- backs the per-message settings lookup by telegram_id.
+create unique index if not exists usersettings_telegram_id_uniq
+  on "UserSettings" (telegram_id);
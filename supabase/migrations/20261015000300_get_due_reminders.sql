@@ -0,0 +1,56 @@
+-- Returns every pending task that is due for a reminder right now, across
+-- all users with notifications enabled, in a single query. Each user's
+-- reminder window is the minute starting 30 minutes from their local "now",
+-- derived from the stored timezone_offset (same formats and limits as
+-- utils.parse_timezone_offset). tasks.scheduled_time holds naive local times.
+create or replace function get_due_reminders()
+returns json
+language sql
+stable
+as $$
+  with users as (
+    select
+      s.user_id,
+      s.telegram_id,
+      regexp_match(s.timezone_offset, '^([+-])(\d{1,2})(?::?(\d{2}))?$') as tz
+    from "UserSettings" s
+    where s.notifications = true
+      and s.telegram_id is not null
+  ),
+  windows as (
+    select
+      users.user_id,
+      users.telegram_id,
+      date_trunc(
+        'minute',
+        (now() at time zone 'UTC')
+          + (users.tz[1] || '1')::int
+            * make_interval(hours => users.tz[2]::int, mins => coalesce(users.tz[3], '0')::int)
+      ) + interval '30 minutes' as window_start
+    from users
+    where users.tz is not null
+      and users.tz[2]::int <= 14
+      and coalesce(users.tz[3], '0')::int <= 59
+  )
+  select coalesce(
+    json_agg(
+      json_build_object(
+        'user_id', w.user_id,
+        'telegram_id', w.telegram_id,
+        'title', t.title,
+        'scheduled_time', t.scheduled_time
+      )
+    ),
+    '[]'::json
+  )
+  from windows w
+  join tasks t on t.user_id = w.user_id
+  where t.is_completed = false
+    and t.scheduled_time >= w.window_start
+    and t.scheduled_time < w.window_start + interval '1 minute';
+$$;
+
+-- Only the bot's service role may call this; anon and authenticated users
+-- could otherwise read every user's due tasks through PostgREST. Later
+-- "create or replace" migrations keep these privileges.
+revoke execute on function get_due_reminders() from public, anon, authenticated;
@@ -0,0 +1,56 @@
+-- Recreate get_due_reminders in PL/pgSQL. Its query runs every minute, and
+-- PL/pgSQL keeps the prepared plan for the session instead of re-planning
+-- it on each call the way a plain SQL function does.
+create or replace function get_due_reminders()
+returns json
+language plpgsql
+stable
+as $$
+declare
+  result json;
+begin
+  with users as (
+    select
+      s.user_id,
+      s.telegram_id,
+      regexp_match(s.timezone_offset, '^([+-])(\d{1,2})(?::?(\d{2}))?$') as tz
+    from "UserSettings" s
+    where s.notifications = true
+      and s.telegram_id is not null
+  ),
+  windows as (
+    select
+      users.user_id,
+      users.telegram_id,
+      date_trunc(
+        'minute',
+        (now() at time zone 'UTC')
+          + (users.tz[1] || '1')::int
+            * make_interval(hours => users.tz[2]::int, mins => coalesce(users.tz[3], '0')::int)
+      ) + interval '30 minutes' as window_start
+    from users
+    where users.tz is not null
+      and users.tz[2]::int <= 14
+      and coalesce(users.tz[3], '0')::int <= 59
+  )
+  select coalesce(
+    json_agg(
+      json_build_object(
+        'user_id', w.user_id,
+        'telegram_id', w.telegram_id,
+        'title', t.title,
+        'scheduled_time', t.scheduled_time
+      )
+    ),
+    '[]'::json
+  )
+  into result
+  from windows w
+  join tasks t on t.user_id = w.user_id
+  where t.is_completed = false
+    and t.scheduled_time >= w.window_start
+    and t.scheduled_time < w.window_start + interval '1 minute';
+
+  return result;
+end;
+$$;
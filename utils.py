@@ -1,23 +1,34 @@
+import os
 import re
+import time
+import asyncio
 import logging
+import functools
+import contextlib
 from datetime import datetime, timedelta, timezone
-from Crypto.Cipher import AES
-from Crypto.Random import get_random_bytes
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 import config 
 
 logger = logging.getLogger(__name__)
 
 KEY = bytes.fromhex(config.ENCRYPTION_KEY)
 IV_LENGTH = 12
-AUTH_TAG_LENGTH = 12
+AUTH_TAG_LENGTH = 16
+
+# Built once so the key schedule is not recomputed for every title
+_AEAD = AESGCM(KEY)
+
+_TZ_RE = re.compile(r"^([+-])(\d{1,2})(?::?(\d{2}))?$")
+_DURATION_RE = re.compile(r"(?P<n>[\d\.]+)\s*(?P<unit>hour|hr|h|minute|min|m)?")
 
 def encrypt(text: str) -> str:
     if not text:
         return text
     try:
-        iv = get_random_bytes(IV_LENGTH)
-        cipher = AES.new(KEY, AES.MODE_GCM, nonce=iv)
-        encrypted_bytes, auth_tag = cipher.encrypt_and_digest(text.encode('utf-8'))
+        iv = os.urandom(IV_LENGTH)
+        sealed = _AEAD.encrypt(iv, text.encode('utf-8'), None)
+        encrypted_bytes, auth_tag = sealed[:-AUTH_TAG_LENGTH], sealed[-AUTH_TAG_LENGTH:]
         
         iv_hex = iv.hex()
         auth_tag_hex = auth_tag.hex()
@@ -25,7 +36,7 @@ def encrypt(text: str) -> str:
         
         return f"{iv_hex}:{auth_tag_hex}:{encrypted_hex}"
     except Exception as e:
-        logger.error(f"Encryption failed: {e}")
+        logger.error("Encryption failed: %s", e)
         return text  
 
 def decrypt(hash_str: str) -> str:
@@ -40,25 +51,77 @@ def decrypt(hash_str: str) -> str:
         auth_tag = bytes.fromhex(parts[1])
         encrypted_text = bytes.fromhex(parts[2])
         
-        cipher = AES.new(KEY, AES.MODE_GCM, nonce=iv)
-        decrypted_bytes = cipher.decrypt_and_verify(encrypted_text, auth_tag)
+        decrypted_bytes = _AEAD.decrypt(iv, encrypted_text + auth_tag, None)
         return decrypted_bytes.decode('utf-8')
-    except (ValueError, TypeError) as e:
-        logger.warning(f"Decryption failed for hash '{hash_str[:10]}...': {e}. Returning original text.")
+    except (ValueError, TypeError, InvalidTag) as e:
+        logger.warning("Decryption failed for hash '%s...': %s. Returning original text.", hash_str[:10], e)
         return hash_str
     except Exception as e:
-        logger.error(f"An unexpected error occurred during decryption: {e}")
+        logger.error("An unexpected error occurred during decryption: %s", e)
         return "[Decryption Error]"
 
 
+def encrypt_many(texts: list[str]) -> list[str]:
+    return [encrypt(text) for text in texts]
+
+def decrypt_many(hash_strs: list[str]) -> list[str]:
+    return [decrypt(hash_str) for hash_str in hash_strs]
+
+
+class KeyedLocks:
+    """Per-key asyncio locks that only exist while someone holds or awaits them.
+
+    Unlike a defaultdict(asyncio.Lock), this doesn't keep a lock around for
+    every key ever seen, so memory stays bounded by the keys in use.
+    """
+
+    def __init__(self):
+        self._locks: dict[str, asyncio.Lock] = {}
+        self._users: dict[str, int] = {}
+
+    @contextlib.asynccontextmanager
+    async def hold(self, key: str):
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        self._users[key] = self._users.get(key, 0) + 1
+        try:
+            async with lock:
+                yield
+        finally:
+            self._users[key] -= 1
+            if not self._users[key]:
+                del self._users[key]
+                del self._locks[key]
+
+
+def now_local(tz: timezone, ts: float | None = None) -> datetime:
+    # Pass a shared time.time() value to give several timezones the same instant
+    return datetime.fromtimestamp(time.time() if ts is None else ts, tz)
+
+
+def parse_supabase_ts(ts: str, tz: timezone | None = None) -> datetime:
+    # Task times come back as "YYYY-MM-DDTHH:MM:SS[.ffffff][+HH:MM]" but only
+    # the wall-clock part is meaningful, so parse just that and attach tz once
+    if len(ts) >= 19 and ts[10] in "T ":
+        dt = datetime.fromisoformat(ts[:19])
+    else:
+        dt = datetime.fromisoformat(ts).replace(tzinfo=None)
+    return dt.replace(tzinfo=tz) if tz else dt
+
+
+# The same offset format and limits (_TZ_RE, hours <= 14, minutes <= 59) are
+# reimplemented in SQL by get_today_schedule and get_due_reminders under
+# supabase/migrations/; keep them in sync when changing either.
+@functools.lru_cache(maxsize=4096)
 def parse_timezone_offset(offset_str: str | None) -> timezone | None:
     if not offset_str:
         return None
     
-    match = re.match(r"^([+-])(\d{1,2})(?::?(\d{2}))?$", offset_str)
+    match = _TZ_RE.match(offset_str)
     
     if not match:
-        logger.warning(f"Invalid timezone format: {offset_str}")
+        logger.warning("Invalid timezone format: %s", offset_str)
         return None
         
     try:
@@ -67,70 +130,104 @@ def parse_timezone_offset(offset_str: str | None) -> timezone | None:
         minutes = int(match.group(3) or 0)
         
         if hours > 14 or minutes > 59:
-             logger.warning(f"Invalid timezone range: {offset_str}")
+             logger.warning("Invalid timezone range: %s", offset_str)
              return None
              
         offset_delta = timedelta(hours=hours, minutes=minutes)
         return timezone(sign * offset_delta, name=f"UTC{offset_str}")
     except Exception as e:
-        logger.error(f"Error parsing offset '{offset_str}': {e}")
+        logger.error("Error parsing offset '%s': %s", offset_str, e)
         return None
 
 def parse_duration_to_minutes(duration_str: str) -> int | None:
     duration_str = duration_str.lower().strip()
-    logger.info(f"Parsing duration: {duration_str}")
+    logger.debug("Parsing duration: %s", duration_str)
     try:
-        match = re.search(r"([\d\.]+)\s*(hour|hr|h)", duration_str)
-        if match:
-            return int(float(match.group(1)) * 60)
-        
-        match = re.search(r"([\d\.]+)\s*(minute|min|m)", duration_str)
-        if match:
-            return int(float(match.group(1)))
-            
-        match = re.search(r"^([\d\.]+)$", duration_str)
-        if match:
-            return int(float(match.group(1)))
+        # One scan over the string: an hour amount anywhere wins, then the
+        # first minute amount, then a bare number making up the whole string
+        minutes_match = None
+        for match in _DURATION_RE.finditer(duration_str):
+            unit = match.group("unit")
+            if unit is None:
+                if match.group(0) == duration_str:
+                    return int(float(match.group("n")))
+                continue
+            if unit[0] == "h":
+                return int(float(match.group("n")) * 60)
+            if minutes_match is None:
+                minutes_match = match
+
+        if minutes_match:
+            return int(float(minutes_match.group("n")))
             
-        logger.warning(f"Could not parse duration: {duration_str}")
+        logger.warning("Could not parse duration: %s", duration_str)
         return None
         
     except Exception as e:
-        logger.error(f"Failed to parse duration '{duration_str}': {e}")
+        logger.error("Failed to parse duration '%s': %s", duration_str, e)
+        return None
+
+def _clock_field(digits: str, low: int, high: int) -> int | None:
+    if not (0 < len(digits) <= 2 and digits.isascii() and digits.isdigit()):
+        return None
+    value = int(digits)
+    return value if low <= value <= high else None
+
+def _parse_clock(time_str: str) -> tuple[int, int] | None:
+    # Fast path for the common "17:30", "5:30PM" and "5PM" shapes, which
+    # avoids strptime re-parsing its format on every call. Returns
+    # (hour, minute), or None to defer to strptime.
+    if time_str.endswith(("AM", "PM")):
+        hour_str, sep, minute_str = time_str[:-2].partition(":")
+        hour = _clock_field(hour_str, 1, 12)
+        minute = _clock_field(minute_str, 0, 59) if sep else 0
+        if hour is None or minute is None:
+            return None
+        return hour % 12 + (12 if time_str[-2] == "P" else 0), minute
+
+    hour_str, sep, minute_str = time_str.partition(":")
+    if not sep:
         return None
+    hour = _clock_field(hour_str, 0, 23)
+    minute = _clock_field(minute_str, 0, 59)
+    if hour is None or minute is None:
+        return None
+    return hour, minute
 
 def parse_local_time_to_naive_datetime(time_str: str, user_timezone: timezone) -> datetime | None:
     time_str = time_str.strip().upper()
-    logger.info(f"Parsing local time: {time_str} for timezone {user_timezone.tzname(None)}")
-    
-    time_formats_to_try = ["%H:%M", "%I:%M%p", "%I%p"] # e.g., "17:30", "5:30PM", "5PM"
-    parsed_time = None
+    logger.debug("Parsing local time: %s for timezone %s", time_str, user_timezone)
     
-    for fmt in time_formats_to_try:
-        try:
-            parsed_time = datetime.strptime(time_str, fmt).time()
-            break # Success
-        except ValueError:
-            continue
+    parsed_time = _parse_clock(time_str)
+
+    if parsed_time is None:
+        time_formats_to_try = ["%H:%M", "%I:%M%p", "%I%p"] # e.g., "17:30", "5:30PM", "5PM"
+        for fmt in time_formats_to_try:
+            try:
+                t = datetime.strptime(time_str, fmt).time()
+                parsed_time = (t.hour, t.minute)
+                break # Success
+            except ValueError:
+                continue
     
     if parsed_time is None:
-        logger.warning(f"Could not parse time string: {time_str}")
+        logger.warning("Could not parse time string: %s", time_str)
         return None # Failed to parse
 
-    now_local = datetime.now(user_timezone)
+    local_now = now_local(user_timezone)
     
-    task_dt_local = now_local.replace(
-        hour=parsed_time.hour, 
-        minute=parsed_time.minute, 
+    task_dt_local = local_now.replace(
+        hour=parsed_time[0], 
+        minute=parsed_time[1], 
         second=0, 
         microsecond=0
     )
 
-    if task_dt_local < now_local:
-        logger.info("Parsed time is in the past, assuming tomorrow.")
+    if task_dt_local < local_now:
+        logger.debug("Parsed time is in the past, assuming tomorrow.")
         task_dt_local += timedelta(days=1)
         
     task_dt_naive = task_dt_local.replace(tzinfo=None)
-    logger.info(f"Converted {time_str} to naive datetime {task_dt_naive.isoformat()} for DB storage")
+    logger.debug("Converted %s to naive datetime %s for DB storage", time_str, task_dt_naive)
     
     return task_dt_naive
\ No newline at end of file